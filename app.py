@@ -5,28 +5,57 @@ ENSA Oujda - 2025
 """
 
 import os
-import json
+import io
+import atexit
+import hashlib
 import logging
+import asyncio
+import random
+import threading
 import time
+import multiprocessing
+import queue
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from pathlib import Path
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, List, Optional, Tuple, BinaryIO, Awaitable
 
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, Response, render_template, request, send_file, session
 from dotenv import load_dotenv
+import orjson
 import secrets
 import re
+import string
 
 # Client Groq AI
 try:
-    from groq import Groq
+    from groq import AsyncGroq, RateLimitError, APIStatusError, APIConnectionError
 except ImportError:
-    Groq = None
+    AsyncGroq = None
+    RateLimitError = None
+    APIStatusError = None
+    APIConnectionError = None
     logging.error("❌ Module 'groq' non installé. Exécutez: pip install groq")
 
+# Transport aiohttp (optionnel) : meilleure concurrence que httpx
+try:
+    from groq import DefaultAioHttpClient
+except ImportError:
+    DefaultAioHttpClient = None
+
+try:
+    import httpx
+    from groq import DefaultAsyncHttpxClient
+except ImportError:
+    httpx = None
+    DefaultAsyncHttpxClient = None
+
 # ReportLab pour PDF professionnel
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.platypus import (
     SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, 
     PageBreak, KeepTogether, Image, Frame
@@ -37,12 +66,44 @@ from reportlab.pdfgen import canvas
 
 # ==================== CONFIGURATION ====================
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Les appels de log se contentent d'empiler l'enregistrement ; l'écriture sur
+# stderr est faite par un thread dédié (QueueListener)
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_queue_handler = QueueHandler(queue.SimpleQueue())
+logging.basicConfig(level=logging.INFO, format='%(message)s', handlers=[_log_queue_handler])
 logger = logging.getLogger(__name__)
 
+_log_listener = None
+_log_listener_pid = None
+
+
+def start_log_listener():
+    """
+    Démarre le thread d'écriture des logs, une fois par processus.
+    
+    À rappeler après un fork (ex: hook post_fork de gunicorn) : le thread du
+    parent n'existe pas dans le processus enfant.
+    """
+    global _log_listener, _log_listener_pid
+    if _log_listener_pid == os.getpid():
+        return
+    log_queue = queue.SimpleQueue()
+    _log_queue_handler.queue = log_queue
+    _log_listener = QueueListener(log_queue, _log_output, respect_handler_level=True)
+    _log_listener.start()
+    _log_listener_pid = os.getpid()
+
+
+@atexit.register
+def stop_log_listener():
+    """Vide la file de logs avant l'arrêt du processus"""
+    if _log_listener is not None and _log_listener_pid == os.getpid():
+        _log_listener.stop()
+
+
+start_log_listener()
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -51,49 +112,315 @@ app.secret_key = secrets.token_hex(32)
 STATIC_FOLDER = 'static'
 OUTPUT_FOLDER = os.path.join(STATIC_FOLDER, 'rapports')
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+OUTPUT_DIR = Path(OUTPUT_FOLDER).resolve()
+
+# Numéros d'ordre affichés sur la page de garde (non sensibles : pas besoin de secrets)
+_ORDER_RNG = random.Random()
 
 GROQ_API_KEY = os.getenv('GROQ_API_KEY', '')
 groq_client = None
 
 DEFAULT_MODEL = "llama-3.3-70b-versatile"
-MAX_RETRIES = 3
+FAST_MODEL = os.getenv('GROQ_FAST_MODEL', 'llama-3.1-8b-instant')
+
+# Sections formulaïques confiées au modèle rapide (avec exemples, voir _FEW_SHOT) ;
+# les autres utilisent DEFAULT_MODEL
+SECTION_MODEL_MAP = {
+    'remerciements': FAST_MODEL,
+}
+
+# Budget de tokens par section, dimensionné sur la longueur demandée dans les
+# prompts (la latence croît avec la longueur de sortie) ; chapitres: défaut
+DEFAULT_MAX_TOKENS = 4096
+SECTION_MAX_TOKENS = {
+    'analyse': 1024,
+    'remerciements': 1024,
+    'introduction': 2048,
+    'conclusion': 2048,
+    'biblio': 1024,
+}
+
+# Arrêt anticipé si le modèle enchaîne sur une autre section (seulement pour
+# les sections sans sous-titres)
+SECTION_STOP = {
+    'remerciements': ["\n\n## ", "\n---"],
+}
+MAX_RETRIES = 4
 RETRY_DELAY = 3  # secondes
+MAX_RETRY_WAIT = 60  # attente maximale entre deux tentatives (secondes)
+BASE_TEMPERATURE = 0.4  # Balance créativité/cohérence
+
+# Regroupe les sections en 3 appels JSON (remerciements et conclusion /
+# introduction et bibliographie / chapitres) au lieu d'un appel par section :
+# moins de requêtes, utile si la clé est limitée en RPM
+BATCH_SECTIONS = os.getenv('BATCH_SECTIONS', '0') == '1'
+BATCH_MAX_TOKENS = 16384
+
+# Processus dédiés à la construction des PDF (travail CPU ReportLab, hors GIL)
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', str(os.cpu_count() or 1)))
+
+# Cache des réponses LLM (activer avec LLM_CACHE=1)
+LLM_CACHE = os.getenv('LLM_CACHE', '0') == '1'
+CACHE_DIR = os.getenv('LLM_CACHE_DIR', '.llm_cache')
+
+# Téléchargements servis par nginx (X-Accel-Redirect) plutôt que par Flask
+USE_XACCEL = os.getenv('USE_XACCEL', '0') == '1'
+XACCEL_PREFIX = '/internal-rapports/'
+
+# Limites Groq : requêtes simultanées et requêtes par minute, par processus
+# (sous gunicorn, le débit total vaut WEB_CONCURRENCY x GROQ_RPM)
+GROQ_MAX_CONCURRENCY = int(os.getenv('GROQ_MAX_CONCURRENCY', '4'))
+GROQ_RPM = int(os.getenv('GROQ_RPM', '30'))
+
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Boucle asyncio partagée, exécutée dans un thread dédié.
+    
+    Le client AsyncGroq est lié à la boucle qui l'utilise : une boucle unique
+    et persistante permet de réutiliser le même client entre les requêtes.
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name="groq-loop", daemon=True).start()
+    return _event_loop
+
+
+def run_async(coro) -> Any:
+    """Exécute une coroutine sur la boucle partagée depuis du code synchrone"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    Pool de processus PDF, créé au premier usage.
+    
+    Jamais à l'import : avec gunicorn --preload, chaque worker forké doit
+    avoir son propre pool. 'spawn' plutôt que fork : le processus parent a
+    déjà des threads (boucle asyncio, logs) qu'un fork dupliquerait dans un
+    état incohérent.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pdf_pool
+
+
+class AsyncRateLimiter:
+    """
+    Seau à jetons : autorise une rafale de `burst` appels, puis rpm/60
+    appels par seconde. rpm <= 0 désactive la limite.
+    """
+    
+    def __init__(self, rpm: int, burst: int = 1):
+        self.rate = rpm / 60.0
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated_ts = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self.updated_ts is not None:
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated_ts) * self.rate)
+            self.updated_ts = now
+            if self.tokens < 1:
+                # Attente du prochain jeton sous le verrou : l'ordre d'arrivée est conservé
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1.0
+                self.updated_ts = loop.time()
+            self.tokens -= 1
+
+
+_GROQ_SEM = asyncio.Semaphore(GROQ_MAX_CONCURRENCY)
+_groq_limiter = AsyncRateLimiter(GROQ_RPM, burst=GROQ_MAX_CONCURRENCY)
+
+
+_RE_DURATION_FULL = re.compile(r'\d+(?:\.\d+)?|(?:\d+(?:\.\d+)?(?:ms|h|m|s))+')
+_RE_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)?')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, None: 1}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Durée des en-têtes Groq en secondes ('7', '7.66s', '2m59.56s', '120ms').
+    
+    Toute autre forme (ex: date HTTP dans retry-after) donne None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if not _RE_DURATION_FULL.fullmatch(value):
+        return None
+    parts = _RE_DURATION.findall(value)
+    return sum(float(number) * _DURATION_UNITS[unit or None] for number, unit in parts)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Erreurs transitoires (réseau, 408/409/429, 5xx) ; une requête invalide est définitive"""
+    if APIStatusError is not None and isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return True
+
+
+def retry_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """
+    Délai avant nouvelle tentative.
+    
+    Respecte retry-after si Groq le renvoie. x-ratelimit-reset-requests
+    (présent sur toutes les réponses : délai de remplissage complet du quota)
+    n'est pris en compte que pour un 429. Sinon backoff exponentiel avec
+    jitter pour les 429 et erreurs réseau, délai fixe pour le reste.
+    """
+    rate_limited = RateLimitError is not None and isinstance(error, RateLimitError)
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers:
+        names = ('retry-after', 'x-ratelimit-reset-requests') if rate_limited else ('retry-after',)
+        for name in names:
+            wait = parse_duration(headers.get(name))
+            if wait is not None:
+                return min(wait, MAX_RETRY_WAIT) + random.uniform(0, 0.5)
+    transient = (
+        rate_limited
+        or (APIConnectionError is not None and isinstance(error, APIConnectionError))
+    )
+    if transient:
+        return min(RETRY_DELAY * 2 ** attempt + random.uniform(0, RETRY_DELAY), MAX_RETRY_WAIT)
+    return RETRY_DELAY
+
+
+def build_http_client():
+    """
+    Client HTTP partagé par tous les appels Groq : aiohttp si disponible,
+    sinon httpx. Les connexions keep-alive sont dimensionnées sur
+    GROQ_MAX_CONCURRENCY pour réutiliser les sessions TLS entre requêtes.
+    """
+    if httpx is None:
+        return None
+    limits = httpx.Limits(max_connections=GROQ_MAX_CONCURRENCY * 2,
+                          max_keepalive_connections=GROQ_MAX_CONCURRENCY)
+    if DefaultAioHttpClient is not None:
+        try:
+            return DefaultAioHttpClient(limits=limits)
+        except RuntimeError:
+            # SDK installé sans l'extra [aiohttp]
+            pass
+    return DefaultAsyncHttpxClient(limits=limits)
 
 
 def get_groq_client():
-    """Initialise et retourne le client Groq avec vérification"""
+    """Initialise et retourne le client Groq asynchrone avec vérification"""
     global groq_client
     if groq_client is None and GROQ_API_KEY:
         try:
-            groq_client = Groq(api_key=GROQ_API_KEY)
-            logger.info("✅ Client Groq initialisé")
+            http_client = build_http_client()
+            # Retries gérés par generate_academic_content_async (hors sémaphore),
+            # pas par le SDK
+            groq_client = AsyncGroq(api_key=GROQ_API_KEY, http_client=http_client, max_retries=0)
+            aiohttp_client = DefaultAioHttpClient is not None and isinstance(http_client, DefaultAioHttpClient)
+            transport = "aiohttp" if aiohttp_client else "httpx"
+            logger.info(f"✅ Client Groq initialisé ({transport})")
         except Exception as e:
             logger.error(f"❌ Erreur init Groq: {e}")
     return groq_client
 
 
+@atexit.register
+def close_groq_client():
+    """Ferme proprement les connexions du client Groq à l'arrêt du processus"""
+    if groq_client is None or _event_loop is None or not _event_loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(groq_client.close(), _event_loop).result(timeout=5)
+    except Exception as e:
+        logger.warning(f"⚠️ Fermeture client Groq: {e}")
+
+
+# ==================== CACHE LLM ====================
+
+def normalize_prompt(prompt: str) -> str:
+    """Forme canonique d'un prompt: espacements ignorés, casse conservée"""
+    return ' '.join(prompt.split())
+
+
+def cache_key(prompt: str, is_json: bool, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """
+    Clé de cache: empreinte de la configuration de génération (modèle,
+    température, longueur, format) et du prompt normalisé.
+    """
+    raw = f"{model}|{BASE_TEMPERATURE}|{max_tokens}|{is_json}|{normalize_prompt(prompt)}"
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=20).hexdigest()
+
+
+@lru_cache(maxsize=128)
+def _cache_read(key: str) -> bytes:
+    """Lit une entrée du cache disque (une absence lève une exception, jamais mémorisée)"""
+    with open(os.path.join(CACHE_DIR, f"{key}.json"), 'rb') as f:
+        return f.read()
+
+
+def cache_get(key: str) -> Any:
+    """Retourne la réponse en cache (mémoire puis disque) ou None"""
+    if not LLM_CACHE:
+        return None
+    try:
+        return orjson.loads(_cache_read(key))
+    except (OSError, ValueError):
+        return None
+
+
+def cache_set(key: str, value: Any):
+    """Enregistre une réponse sur disque (écriture atomique)"""
+    if not LLM_CACHE:
+        return
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(value))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"⚠️ Cache LLM non écrit: {e}")
+
+
 # ==================== MOTEUR IA ROBUSTE ====================
 
-def generate_academic_content(prompt: str, section_name: str = "contenu", 
-                             is_json: bool = False) -> Any:
+async def collect_stream(stream) -> Tuple[str, Optional[str]]:
     """
-    Génère du contenu académique via Groq avec retry automatique.
-    
-    Args:
-        prompt: Le prompt de génération
-        section_name: Nom de la section (pour logs)
-        is_json: Force JSON en sortie
+    Assemble les fragments d'une réponse Groq en streaming.
     
     Returns:
-        Contenu généré (dict si JSON, str sinon)
+        (texte complet, finish_reason du dernier fragment)
     """
-    client = get_groq_client()
-    if not client:
-        error_msg = "⚠️ Client Groq non disponible. Vérifiez GROQ_API_KEY dans .env"
-        logger.error(error_msg)
-        return {} if is_json else error_msg
-    
-    system_prompt = """Tu es un expert académique de l'ENSA Oujda spécialisé en rédaction de rapports PFE.
+    chunks = []
+    finish_reason = None
+    async for event in stream:
+        if event.choices:
+            choice = event.choices[0]
+            chunks.append(choice.delta.content or '')
+            finish_reason = choice.finish_reason or finish_reason
+    return ''.join(chunks), finish_reason
+
+
+_SYSTEM_PROMPT = """Tu es un expert académique de l'ENSA Oujda spécialisé en rédaction de rapports PFE.
 
 🎯 RÈGLES ABSOLUES DE RÉDACTION:
 
@@ -137,98 +464,223 @@ EXEMPLE DE PARAGRAPHE ACADÉMIQUE CORRECT:
 "La conception hydraulique des barrages nécessite une analyse approfondie des caractéristiques hydrologiques du bassin versant. Dans cette optique, les ingénieurs procèdent à l'étude des débits de crue historiques afin d'établir les courbes de débits-fréquences permettant de dimensionner l'évacuateur de crues. Par ailleurs, la modélisation hydrologique intègre les données pluviométriques sur plusieurs décennies pour estimer les apports en eau et les périodes de remplissage optimales. En outre, l'analyse de la bathymétrie du site permet de déterminer la capacité de stockage en fonction des différentes cotes de retenue, information cruciale pour l'optimisation du volume utile du réservoir."
 """
 
+# Message système partagé par tous les appels (ne jamais le modifier)
+_SYSTEM_MSG = {"role": "system", "content": _SYSTEM_PROMPT}
+
+# Exemples (échange utilisateur/assistant) placés avant la demande réelle
+# pour guider le modèle rapide sur le ton et la forme attendus
+_FEW_SHOT = {
+    'remerciements': [
+        {"role": "user", "content": "Rédige des REMERCIEMENTS formels et chaleureux pour un rapport PFE ENSA Oujda.\n\n"
+                                    "**Contexte:**\n- Étudiant: Yassine El Amrani\n- Encadrant: Pr. Karim Bennani\n"
+                                    "- Entreprise: OCP Group\n- Jury: les membres du jury"},
+        {"role": "assistant", "content": (
+            "Au terme de ce travail, je tiens à exprimer ma profonde gratitude à mon encadrant, le Professeur "
+            "Karim Bennani, pour la qualité de son accompagnement tout au long de ce projet. Sa disponibilité, "
+            "la pertinence de ses remarques et la rigueur qu'il a su m'inculquer ont constitué des repères "
+            "précieux à chaque étape de ma réflexion.\n\n"
+            "J'adresse également mes sincères remerciements à l'ensemble du corps professoral de l'École "
+            "Nationale des Sciences Appliquées d'Oujda, dont les enseignements ont forgé les compétences "
+            "mobilisées dans ce projet. Leur engagement pédagogique a nourri ma curiosité scientifique et "
+            "mon goût pour les défis techniques.\n\n"
+            "Ma reconnaissance s'adresse aussi aux équipes d'OCP Group, qui m'ont accueilli avec bienveillance "
+            "et m'ont accordé leur confiance. Les échanges avec les ingénieurs du site ont largement enrichi "
+            "ma compréhension des enjeux industriels liés à ce travail.\n\n"
+            "Je remercie vivement les membres du jury pour l'honneur qu'ils me font en acceptant d'évaluer ce "
+            "rapport, ainsi que pour le temps qu'ils consacreront à son examen.\n\n"
+            "Enfin, je ne saurais conclure sans exprimer toute mon affection à ma famille et à mes amis, dont "
+            "le soutien constant et les encouragements ont été une source inépuisable de motivation."
+        )},
+    ],
+}
+
+
+class GenerationError(Exception):
+    """Contenu non obtenu de Groq malgré les tentatives"""
+
+
+async def generate_academic_content_async(prompt: str, section_name: str = "contenu",
+                                         is_json: bool = False, max_tokens: int = DEFAULT_MAX_TOKENS,
+                                         model: str = DEFAULT_MODEL,
+                                         examples: Optional[List[Dict[str, str]]] = None,
+                                         stop: Optional[List[str]] = None) -> Any:
+    """
+    Génère du contenu académique via Groq avec retry automatique.
+    
+    Args:
+        prompt: Le prompt de génération
+        section_name: Nom de la section (pour logs)
+        is_json: Force JSON en sortie
+        max_tokens: Longueur maximale de la réponse
+        model: Modèle Groq à utiliser
+        examples: Messages d'exemple insérés avant le prompt (few-shot)
+        stop: Séquences d'arrêt de la génération
+    
+    Returns:
+        Contenu généré (dict si JSON, str sinon)
+    
+    Raises:
+        GenerationError: client indisponible ou échec après les tentatives
+    """
+    key = cache_key(prompt, is_json, max_tokens, model)
+    cached = cache_get(key)
+    if cached is not None:
+        logger.info(f"⚡ [{section_name}] Servi depuis le cache")
+        return cached
+    
+    client = get_groq_client()
+    if not client:
+        error_msg = "⚠️ Client Groq non disponible. Vérifiez GROQ_API_KEY dans .env"
+        logger.error(error_msg)
+        raise GenerationError(error_msg)
+    
+    messages = [_SYSTEM_MSG, *(examples or ()), {"role": "user", "content": prompt}]
+    
     for attempt in range(MAX_RETRIES):
         try:
             logger.info(f"🔄 Génération [{section_name}] - Tentative {attempt + 1}/{MAX_RETRIES}")
             
-            response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                model=DEFAULT_MODEL,
-                temperature=0.4,  # Balance créativité/cohérence
-                max_tokens=4096,
-                response_format={"type": "json_object"} if is_json else None
-            )
+            async with _GROQ_SEM:
+                await _groq_limiter.acquire()
+                response = await client.chat.completions.create(
+                    messages=messages,
+                    model=model,
+                    # Température relevée à chaque retry pour obtenir une réponse différente
+                    temperature=min(0.9, BASE_TEMPERATURE + 0.2 * attempt),
+                    max_tokens=max_tokens,
+                    stop=stop,
+                    response_format={"type": "json_object"} if is_json else None,
+                    stream=not is_json  # Le mode JSON ne supporte pas le streaming
+                )
+                if is_json:
+                    content = response.choices[0].message.content or ''
+                    finish_reason = response.choices[0].finish_reason
+                else:
+                    content, finish_reason = await collect_stream(response)
+            
+            if finish_reason == 'length':
+                logger.warning(f"⚠️ [{section_name}] Réponse tronquée à {max_tokens} tokens")
             
-            content = response.choices[0].message.content
+            # Réponse vide bloquée par le filtre : un retry donnerait le même résultat
+            if finish_reason == 'content_filter' and not content.strip():
+                logger.error(f"❌ [{section_name}] Réponse bloquée par le filtre de contenu")
+                break
             
             if is_json:
-                parsed = json.loads(content)
+                parsed = orjson.loads(content)
                 logger.info(f"✅ [{section_name}] JSON généré")
+                cache_set(key, parsed)
                 return parsed
             
-            # Nettoyage du texte
-            content = clean_text(content)
-            
-            # Validation longueur minimale
-            if len(content.strip()) < 200:
+            # Validation longueur minimale, sur le texte brut : une réponse
+            # rejetée n'a pas besoin d'être nettoyée
+            too_short = len(content) < 200
+            if too_short:
                 logger.warning(f"⚠️ [{section_name}] Contenu trop court, retry...")
                 if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY)
+                    await asyncio.sleep(RETRY_DELAY)
                     continue
             
+            # Nettoyage du texte retenu
+            content = clean_text(content)
+            if not too_short:
+                cache_set(key, content)
+            
             logger.info(f"✅ [{section_name}] Généré ({len(content)} chars)")
             return content
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"❌ [{section_name}] JSON invalide: {e}")
             if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
+                await asyncio.sleep(RETRY_DELAY)
             else:
-                return {} if is_json else f"Erreur JSON pour {section_name}"
+                raise GenerationError(f"Erreur JSON pour {section_name}")
                 
         except Exception as e:
             logger.error(f"❌ [{section_name}] Erreur: {e}")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
+            if attempt < MAX_RETRIES - 1 and is_retryable(e):
+                await asyncio.sleep(retry_delay(attempt, e))
             else:
-                return {} if is_json else f"Erreur de génération pour {section_name}. Veuillez réessayer."
-    
-    # Fallback après tous les retries
-    return {} if is_json else f"Impossible de générer {section_name} après {MAX_RETRIES} tentatives."
+                raise GenerationError(f"Erreur de génération pour {section_name}") from e
+    
+    # Échec après tous les retries
+    raise GenerationError(f"Impossible de générer {section_name} après {MAX_RETRIES} tentatives")
+
+
+# Motifs de nettoyage compilés une seule fois, appliqués dans l'ordre
+# d'origine : fusionnés en une alternation, ils ne donnent pas le même
+# résultat sur les marqueurs imbriqués (***x***, **_x_**, - 1. x...)
+_RE_BULLET = re.compile(r'^[\s]*[-•*]\s+', re.MULTILINE)
+_RE_NUM = re.compile(r'^[\s]*\d+\.\s+', re.MULTILINE)
+_RE_MD = (  # (marqueur testé avant la regex, motif)
+    ('**', re.compile(r'\*\*(.+?)\*\*')),
+    ('*', re.compile(r'\*(.+?)\*')),
+    ('__', re.compile(r'__(.+?)__')),
+    ('_', re.compile(r'_(.+?)_')),
+)
+_RE_CODEBLOCK = re.compile(r'```.*?```', re.DOTALL)
+_RE_CODE = re.compile(r'`(.+?)`')
+_RE_NEWLINES = re.compile(r'\n{3,}')
+_RE_SPACES = re.compile(r' {2,}')
+
+
+def normalize_whitespace(text: str) -> str:
+    """Limite à 2 retours ligne et 1 espace consécutifs"""
+    # Test de sous-chaîne (C) avant la regex : évite une copie du texte
+    # quand il n'y a rien à réduire, cas le plus fréquent en sortie LLM
+    if '\n\n\n' in text:
+        text = _RE_NEWLINES.sub('\n\n', text)
+    if '  ' in text:
+        text = _RE_SPACES.sub(' ', text)
+    return text
+
+
+def split_paragraphs(text: str) -> List[Tuple[str, str]]:
+    """Découpe un texte en paragraphes typés: ('sub', sous-titre) ou ('body', texte)"""
+    paragraphs = []
+    for para in text.split('\n\n'):
+        para = para.strip()
+        if not para:
+            continue
+        if para.startswith('##'):
+            paragraphs.append(('sub', para.lstrip('#').lstrip()))
+        else:
+            paragraphs.append(('body', para))
+    return paragraphs
 
 
 def clean_text(text: str) -> str:
     """Nettoie le texte des artefacts markdown et normalise"""
     # Supprimer listes à puces/numéros
-    text = re.sub(r'^[\s]*[-•*]\s+', '', text, flags=re.MULTILINE)
-    text = re.sub(r'^[\s]*\d+\.\s+', '', text, flags=re.MULTILINE)
-    
-    # Supprimer markdown
-    text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)  # bold
-    text = re.sub(r'\*(.+?)\*', r'\1', text)      # italic
-    text = re.sub(r'__(.+?)__', r'\1', text)
-    text = re.sub(r'_(.+?)_', r'\1', text)
-    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)  # code blocks
-    text = re.sub(r'`(.+?)`', r'\1', text)
+    text = _RE_BULLET.sub('', text)
+    text = _RE_NUM.sub('', text)
     
-    # Normaliser espaces
-    text = re.sub(r'\n{3,}', '\n\n', text)  # Max 2 retours ligne
-    text = re.sub(r' {2,}', ' ', text)      # Max 1 espace
+    # Supprimer markdown : test de sous-chaîne avant chaque regex, le
+    # texte n'est recopié que si le marqueur est présent
+    for marker, pattern in _RE_MD:
+        if marker in text:
+            text = pattern.sub(r'\1', text)
+    if '`' in text:
+        text = _RE_CODEBLOCK.sub('', text)
+        text = _RE_CODE.sub(r'\1', text)
     
-    return text.strip()
+    return normalize_whitespace(text).strip()
 
 
-# ==================== ANALYSE & STRUCTURE ====================
+# ==================== PROMPTS ====================
 
-def analyze_project(user_data: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Analyse intelligente du projet et génération structure adaptée.
-    
-    Returns:
-        {department, filiere, order_id, structure: [chapitres]}
-    """
-    analysis_prompt = f"""Analyse ce projet PFE et génère une structure professionnelle adaptée:
+# Modèles de prompts (string.Template) : construits une fois à l'import,
+# seules les variables $nom sont substituées à chaque appel
+
+_TMPL_ANALYZE = string.Template("""Analyse ce projet PFE et génère une structure professionnelle adaptée:
 
 📋 DONNÉES PROJET:
-- Sujet: {user_data.get('subject', 'Non spécifié')}
-- Filière: {user_data.get('student_filiere', 'Non spécifiée')}
-- Contexte: {user_data.get('context', '')}
-- Technologies: {user_data.get('technologies', '')}
-- Objectifs: {user_data.get('objectives', '')}
-- Domaine: {user_data.get('domain', '')}
+- Sujet: ${subject}
+- Filière: ${filiere}
+- Contexte: ${context}
+- Technologies: ${technologies}
+- Objectifs: ${objectives}
+- Domaine: ${domain}
 
 🎯 TÂCHES:
 
@@ -245,7 +697,7 @@ def analyze_project(user_data: Dict[str, Any]) -> Dict[str, Any]:
    Confirme ou corrige la filière (ex: "Génie Hydraulique", "Ingénierie Logicielle")
 
 3. NUMÉRO D'ORDRE
-   Format: ENSA-OUD-{datetime.now().year}-XXX
+   Format: ENSA-OUD-${year}-XXX
    (XXX = numéro aléatoire 3 chiffres)
 
 4. STRUCTURE INTELLIGENTE (3 chapitres)
@@ -264,80 +716,24 @@ def analyze_project(user_data: Dict[str, Any]) -> Dict[str, Any]:
    Titres SPÉCIFIQUES au projet, pas génériques!
 
 📤 RÉPONSE JSON:
-{{
+{
     "department": "Département exact",
     "filiere": "Filière précise",
     "order_id": "ENSA-OUD-YYYY-XXX",
     "structure": [
-        {{"id": "chapitre1", "title": "Titre spécifique chapitre 1", "keywords": ["mot-clé1", "mot-clé2"]}},
-        {{"id": "chapitre2", "title": "Titre spécifique chapitre 2", "keywords": ["mot-clé1", "mot-clé2"]}},
-        {{"id": "chapitre3", "title": "Titre spécifique chapitre 3", "keywords": ["mot-clé1", "mot-clé2"]}}
+        {"id": "chapitre1", "title": "Titre spécifique chapitre 1", "keywords": ["mot-clé1", "mot-clé2"]},
+        {"id": "chapitre2", "title": "Titre spécifique chapitre 2", "keywords": ["mot-clé1", "mot-clé2"]},
+        {"id": "chapitre3", "title": "Titre spécifique chapitre 3", "keywords": ["mot-clé1", "mot-clé2"]}
     ]
-}}"""
+}""")
 
-    result = generate_academic_content(analysis_prompt, "Analyse Structure", is_json=True)
-    
-    # Valeurs par défaut robustes
-    if not result or not isinstance(result, dict):
-        logger.warning("⚠️ Structure par défaut utilisée")
-        return {
-            "department": "Génie Informatique",
-            "filiere": user_data.get('student_filiere', 'Cycle Ingénieur'),
-            "order_id": f"ENSA-OUD-{datetime.now().year}-{secrets.randbelow(900) + 100:03d}",
-            "structure": [
-                {"id": "chapitre1", "title": "Contexte général et état de l'art", "keywords": []},
-                {"id": "chapitre2", "title": "Analyse et conception", "keywords": []},
-                {"id": "chapitre3", "title": "Réalisation et résultats", "keywords": []}
-            ]
-        }
-    
-    # Assurer order_id unique
-    if 'order_id' not in result:
-        result['order_id'] = f"ENSA-OUD-{datetime.now().year}-{secrets.randbelow(900) + 100:03d}"
-    
-    return result
-
-
-# ==================== GÉNÉRATION SECTIONS ====================
-
-def generate_all_sections(user_data: Dict[str, Any], metadata: Dict[str, Any]) -> Dict[str, str]:
-    """
-    Génère toutes les sections du rapport avec gestion d'erreurs robuste.
-    
-    Returns:
-        Dict[section_id, content]
-    """
-    sections = {}
-    structure = metadata.get('structure', [])
-    
-    # Construction contexte enrichi
-    context_parts = []
-    if user_data.get('subject'):
-        context_parts.append(f"**Sujet:** {user_data['subject']}")
-    if user_data.get('student_filiere'):
-        context_parts.append(f"**Filière:** {user_data['student_filiere']}")
-    if user_data.get('context'):
-        context_parts.append(f"**Contexte:** {user_data['context']}")
-    if user_data.get('objectives'):
-        context_parts.append(f"**Objectifs:** {user_data['objectives']}")
-    if user_data.get('technologies'):
-        context_parts.append(f"**Technologies:** {user_data['technologies']}")
-    if user_data.get('methodology'):
-        context_parts.append(f"**Méthodologie:** {user_data['methodology']}")
-    if user_data.get('results'):
-        context_parts.append(f"**Résultats attendus:** {user_data['results']}")
-    
-    project_context = "\n".join(context_parts) if context_parts else "Projet de fin d'études."
-    
-    # ========== 1. REMERCIEMENTS ==========
-    logger.info("📝 Génération: Remerciements")
-    remerciements_prompt = f"""Rédige des REMERCIEMENTS formels et chaleureux pour un rapport PFE ENSA Oujda.
+_TMPL_REMERCIEMENTS = string.Template("""Rédige des REMERCIEMENTS formels et chaleureux pour un rapport PFE ENSA Oujda.
 
 **Contexte:**
-- Étudiant: {user_data.get('student_name', 'l\'étudiant')}
-- Encadrant: {user_data.get('supervisor', 'l\'encadrant académique')}
-- Entreprise: {user_data.get('company', '') or 'ENSA Oujda'}
-- Jury: {user_data.get('jury', 'les membres du jury')}
+- Étudiant: ${student_name}
+- Encadrant: ${supervisor}
+- Entreprise: ${company}
+- Jury: ${jury}
 
 **Structure attendue (paragraphes narratifs):**
 1. Remerciement sincère à l'encadrant pour guidance et soutien
@@ -350,20 +746,13 @@ def generate_all_sections(user_data: Dict[str, Any], metadata: Dict[str, Any]) -
 - 4-5 paragraphes fluides et personnalisés
 - Ton reconnaissant mais professionnel
 - Transitions naturelles entre remerciements
-- Aucune liste, tout en prose"""
+- Aucune liste, tout en prose""")
 
-    sections['remerciements'] = generate_academic_content(
-        remerciements_prompt, 
-        "Remerciements"
-    )
-    
-    # ========== 2. INTRODUCTION GÉNÉRALE ==========
-    logger.info("📝 Génération: Introduction Générale")
-    intro_prompt = f"""Rédige une INTRODUCTION GÉNÉRALE académique pour un rapport PFE.
+_TMPL_INTRO = string.Template("""Rédige une INTRODUCTION GÉNÉRALE académique pour un rapport PFE.
 
-{project_context}
+${context}
 
-**Département:** {metadata.get('department', 'ENSA Oujda')}
+**Département:** ${department}
 
 **L'introduction doit développer (en paragraphes narratifs):**
 
@@ -396,26 +785,15 @@ def generate_all_sections(user_data: Dict[str, Any], metadata: Dict[str, Any]) -
 - Chaque paragraphe: 5-7 phrases
 - Style académique soutenu
 - Progression logique
-- Aucune liste"""
+- Aucune liste""")
 
-    sections['introduction'] = generate_academic_content(
-        intro_prompt,
-        "Introduction"
-    )
-    
-    # ========== 3. CHAPITRES ==========
-    for i, chap in enumerate(structure, 1):
-        logger.info(f"📝 Génération: Chapitre {i} - {chap['title']}")
-        
-        keywords_str = ", ".join(chap.get('keywords', [])) if chap.get('keywords') else "concepts techniques"
-        
-        chapitre_prompt = f"""Rédige le CONTENU COMPLET du chapitre suivant pour un rapport PFE:
+_TMPL_CHAPITRE = string.Template("""Rédige le CONTENU COMPLET du chapitre suivant pour un rapport PFE:
 
-**CHAPITRE {i}: {chap['title']}**
+**CHAPITRE ${i}: ${title}**
 
-{project_context}
+${context}
 
-**Mots-clés à intégrer:** {keywords_str}
+**Mots-clés à intégrer:** ${keywords}
 
 **Consignes selon la nature du chapitre:**
 
@@ -448,18 +826,11 @@ Si CHAPITRE 3 (Réalisation/Résultats):
 - Sous-titres possibles avec ## (max 3)
 
 **Style:**
-Académique, technique, formel. Connecteurs variés."""
+Académique, technique, formel. Connecteurs variés.""")
 
-        sections[chap['id']] = generate_academic_content(
-            chapitre_prompt,
-            f"Chapitre {i}"
-        )
-    
-    # ========== 4. CONCLUSION GÉNÉRALE ==========
-    logger.info("📝 Génération: Conclusion Générale")
-    conclusion_prompt = f"""Rédige une CONCLUSION GÉNÉRALE pour un rapport PFE.
+_TMPL_CONCLUSION = string.Template("""Rédige une CONCLUSION GÉNÉRALE pour un rapport PFE.
 
-{project_context}
+${context}
 
 **La conclusion doit aborder (en paragraphes fluides):**
 
@@ -493,20 +864,13 @@ Académique, technique, formel. Connecteurs variés."""
 - 5-6 paragraphes narratifs
 - Ton réflexif et prospectif
 - Ouverture vers l'avenir
-- Aucune liste"""
+- Aucune liste""")
 
-    sections['conclusion'] = generate_academic_content(
-        conclusion_prompt,
-        "Conclusion"
-    )
-    
-    # ========== 5. BIBLIOGRAPHIE ==========
-    logger.info("📝 Génération: Bibliographie")
-    biblio_prompt = f"""Génère une BIBLIOGRAPHIE et WEBOGRAPHIE au format IEEE.
+_TMPL_BIBLIO = string.Template("""Génère une BIBLIOGRAPHIE et WEBOGRAPHIE au format IEEE.
 
-**Sujet:** {user_data.get('subject')}
-**Technologies:** {user_data.get('technologies', '')}
-**Domaine:** {metadata.get('department', '')}
+**Sujet:** ${subject}
+**Technologies:** ${technologies}
+**Domaine:** ${department}
 
 **Contenu attendu:**
 
@@ -530,14 +894,460 @@ Académique, technique, formel. Connecteurs variés."""
 - Références réalistes et pertinentes au domaine
 - Numérotation continue [1], [2], etc.
 - Présentation en paragraphes avec numéros
-- Format IEEE standard strict"""
+- Format IEEE standard strict""")
+
+_TMPL_BATCH = string.Template("""Rédige plusieurs sections d'un rapport PFE en une seule réponse.
+Chaque section est introduite par sa clé entre crochets, suivie de ses consignes.
+
+${sections}
+
+📤 RÉPONSE JSON:
+Un objet JSON avec exactement les clés ${keys}.
+Chaque valeur est le texte complet de la section correspondante, en respectant ses consignes.
+Sépare les paragraphes d'une même section par une ligne vide (\\n\\n).""")
+
 
-    sections['biblio'] = generate_academic_content(
-        biblio_prompt,
-        "Bibliographie"
+# ==================== ANALYSE & STRUCTURE ====================
+
+async def analyze_project(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Analyse intelligente du projet et génération structure adaptée.
+    
+    Returns:
+        {department, filiere, order_id, structure: [chapitres]}, avec
+        default_structure=True si la structure par défaut a été utilisée
+    """
+    analysis_prompt = _TMPL_ANALYZE.safe_substitute(
+        subject=user_data.get('subject', 'Non spécifié'),
+        filiere=user_data.get('student_filiere', 'Non spécifiée'),
+        context=user_data.get('context', ''),
+        technologies=user_data.get('technologies', ''),
+        objectives=user_data.get('objectives', ''),
+        domain=user_data.get('domain', ''),
+        year=datetime.now().year
     )
+
+    try:
+        result = await generate_academic_content_async(analysis_prompt, "Analyse Structure", is_json=True,
+                                                       max_tokens=SECTION_MAX_TOKENS['analyse'])
+    except GenerationError:
+        result = None
     
-    return sections
+    # Valeurs par défaut robustes
+    if not result or not isinstance(result, dict):
+        logger.warning("⚠️ Structure par défaut utilisée")
+        return {
+            "department": "Génie Informatique",
+            "filiere": user_data.get('student_filiere', 'Cycle Ingénieur'),
+            "order_id": f"ENSA-OUD-{datetime.now().year}-{_ORDER_RNG.randrange(100, 1000):03d}",
+            "structure": [
+                {"id": "chapitre1", "title": "Contexte général et état de l'art", "keywords": []},
+                {"id": "chapitre2", "title": "Analyse et conception", "keywords": []},
+                {"id": "chapitre3", "title": "Réalisation et résultats", "keywords": []}
+            ],
+            "default_structure": True
+        }
+    
+    # Assurer order_id unique
+    if 'order_id' not in result:
+        result['order_id'] = f"ENSA-OUD-{datetime.now().year}-{_ORDER_RNG.randrange(100, 1000):03d}"
+    
+    return result
+
+
+# ==================== GÉNÉRATION SECTIONS ====================
+
+async def generate_sections_batch(group: Dict[str, Tuple[str, str]]) -> Dict[str, str]:
+    """
+    Génère plusieurs sections en un seul appel JSON.
+    
+    Les sections absentes ou trop courtes dans la réponse sont régénérées
+    individuellement.
+    
+    Returns:
+        Dict[section_id, texte], sans les sections restées en échec
+    """
+    prompt = _TMPL_BATCH.safe_substitute(
+        sections="\n\n".join(f"[{section_id}]\n{job_prompt}" for section_id, (job_prompt, _) in group.items()),
+        keys=", ".join(f'"{section_id}"' for section_id in group)
+    )
+    label = " + ".join(name for _, name in group.values())
+    max_tokens = min(BATCH_MAX_TOKENS, sum(SECTION_MAX_TOKENS.get(sid, DEFAULT_MAX_TOKENS) for sid in group))
+    try:
+        result = await generate_academic_content_async(prompt, label, is_json=True, max_tokens=max_tokens)
+    except GenerationError:
+        result = None
+    
+    texts = {}
+    missing = {}
+    for section_id, job in group.items():
+        text = result.get(section_id) if isinstance(result, dict) else None
+        if isinstance(text, str) and len(text.strip()) >= 200:
+            texts[section_id] = clean_text(text)
+        else:
+            missing[section_id] = job
+    
+    if missing:
+        logger.warning(f"⚠️ [{label}] {len(missing)} section(s) manquante(s), génération individuelle")
+        retried = await asyncio.gather(
+            *(generate_section(section_id, *job) for section_id, job in missing.items()),
+            return_exceptions=True
+        )
+        texts.update((section_id, text) for section_id, text in zip(missing, retried)
+                     if not isinstance(text, BaseException))
+    
+    return texts
+
+
+async def generate_section(section_id: str, prompt: str, name: str) -> str:
+    """Génère une section avec le modèle, les exemples et le budget qui lui sont associés"""
+    model = SECTION_MODEL_MAP.get(section_id, DEFAULT_MODEL)
+    examples = _FEW_SHOT.get(section_id) if model != DEFAULT_MODEL else None
+    return await generate_academic_content_async(
+        prompt, name,
+        max_tokens=SECTION_MAX_TOKENS.get(section_id, DEFAULT_MAX_TOKENS),
+        model=model,
+        examples=examples,
+        stop=SECTION_STOP.get(section_id)
+    )
+
+
+async def generate_group(group: Dict[str, Tuple[str, str]]) -> Dict[str, str]:
+    """Génère un groupe de sections: appel simple pour une section, appel groupé sinon"""
+    if len(group) == 1:
+        (section_id, (prompt, name)), = group.items()
+        return {section_id: await generate_section(section_id, prompt, name)}
+    return await generate_sections_batch(group)
+
+
+def group_jobs(jobs: Dict[str, Tuple[str, str]]) -> List[Dict[str, Tuple[str, str]]]:
+    """Un appel par section, ou un seul appel groupé si BATCH_SECTIONS"""
+    if not jobs:
+        return []
+    if BATCH_SECTIONS:
+        return [jobs]
+    return [{sid: job} for sid, job in jobs.items()]
+
+
+async def generate_all_sections(user_data: Dict[str, Any],
+                                analysis: Awaitable[Dict[str, Any]]) -> Tuple[Dict[str, List[Tuple[str, str]]], List[str]]:
+    """
+    Génère toutes les sections du rapport en parallèle avec gestion d'erreurs robuste.
+    
+    Les sections sont indépendantes : les appels Groq sont lancés simultanément
+    et la durée totale correspond à la section la plus lente. Les remerciements
+    et la conclusion ne dépendent pas de l'analyse et démarrent sans l'attendre.
+    
+    Args:
+        analysis: analyse du projet en cours (voir analyze_project)
+    
+    Returns:
+        (Dict[section_id, paragraphes] (voir split_paragraphs), noms des
+        sections en échec, remplacées par un message d'erreur)
+    """
+    sections = {}
+    failed = []
+    early_jobs = {}  # section_id -> (prompt, nom pour les logs), sans dépendance à l'analyse
+    jobs = {}
+    
+    # Construction contexte enrichi
+    context_parts = []
+    if user_data.get('subject'):
+        context_parts.append(f"**Sujet:** {user_data['subject']}")
+    if user_data.get('student_filiere'):
+        context_parts.append(f"**Filière:** {user_data['student_filiere']}")
+    if user_data.get('context'):
+        context_parts.append(f"**Contexte:** {user_data['context']}")
+    if user_data.get('objectives'):
+        context_parts.append(f"**Objectifs:** {user_data['objectives']}")
+    if user_data.get('technologies'):
+        context_parts.append(f"**Technologies:** {user_data['technologies']}")
+    if user_data.get('methodology'):
+        context_parts.append(f"**Méthodologie:** {user_data['methodology']}")
+    if user_data.get('results'):
+        context_parts.append(f"**Résultats attendus:** {user_data['results']}")
+    
+    project_context = "\n".join(context_parts) if context_parts else "Projet de fin d'études."
+    
+    # Variables communes aux modèles de prompts, calculées une seule fois
+    mapping = {
+        'context': project_context,
+        'student_name': user_data.get('student_name', "l'étudiant"),
+        'supervisor': user_data.get('supervisor', "l'encadrant académique"),
+        'company': user_data.get('company', '') or 'ENSA Oujda',
+        'jury': user_data.get('jury', 'les membres du jury'),
+        'subject': user_data.get('subject'),
+        'technologies': user_data.get('technologies', ''),
+    }
+    
+    # ========== 1. REMERCIEMENTS ==========
+    logger.info("📝 Préparation: Remerciements")
+    remerciements_prompt = _TMPL_REMERCIEMENTS.safe_substitute(mapping)
+
+    early_jobs['remerciements'] = (remerciements_prompt, "Remerciements")
+    
+    # ========== 2. CONCLUSION GÉNÉRALE ==========
+    logger.info("📝 Préparation: Conclusion Générale")
+    conclusion_prompt = _TMPL_CONCLUSION.safe_substitute(mapping)
+
+    early_jobs['conclusion'] = (conclusion_prompt, "Conclusion")
+    
+    early_groups = group_jobs(early_jobs)
+    early_tasks = [asyncio.ensure_future(generate_group(group)) for group in early_groups]
+    
+    # Les tâches anticipées ne doivent jamais rester orphelines : si l'analyse
+    # échoue ou si la génération est annulée, elles sont annulées et attendues
+    try:
+        # ========== 3. ATTENTE DE L'ANALYSE ==========
+        metadata = await analysis
+        structure = metadata.get('structure', [])
+        
+        # ========== 4. INTRODUCTION GÉNÉRALE ==========
+        logger.info("📝 Préparation: Introduction Générale")
+        intro_prompt = _TMPL_INTRO.safe_substitute(
+            mapping,
+            department=metadata.get('department', 'ENSA Oujda')
+        )
+
+        jobs['introduction'] = (intro_prompt, "Introduction")
+        
+        # ========== 5. CHAPITRES ==========
+        chapter_jobs = {}
+        for i, chap in enumerate(structure, 1):
+            logger.info(f"📝 Préparation: Chapitre {i} - {chap['title']}")
+        
+            keywords_str = ", ".join(chap.get('keywords', [])) if chap.get('keywords') else "concepts techniques"
+        
+            chapitre_prompt = _TMPL_CHAPITRE.safe_substitute(
+                mapping,
+                i=i,
+                title=chap['title'],
+                keywords=keywords_str
+            )
+
+            chapter_jobs[chap['id']] = (chapitre_prompt, f"Chapitre {i}")
+        
+        # ========== 6. BIBLIOGRAPHIE ==========
+        logger.info("📝 Préparation: Bibliographie")
+        biblio_prompt = _TMPL_BIBLIO.safe_substitute(
+            mapping,
+            department=metadata.get('department', '')
+        )
+
+        jobs['biblio'] = (biblio_prompt, "Bibliographie")
+        
+        # ========== 7. GÉNÉRATION PARALLÈLE ==========
+        groups = group_jobs(jobs) + group_jobs(chapter_jobs)
+        
+        logger.info(f"🚀 Génération parallèle de {len(jobs) + len(chapter_jobs)} sections ({len(groups)} appels)")
+        results = await asyncio.gather(
+            *early_tasks,
+            *(generate_group(group) for group in groups),
+            return_exceptions=True
+        )
+    finally:
+        for task in early_tasks:
+            task.cancel()
+        await asyncio.gather(*early_tasks, return_exceptions=True)
+    
+    for group, result in zip(early_groups + groups, results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ Erreur de génération: {result}")
+            result = {}
+        for section_id, (_, name) in group.items():
+            text = result.get(section_id)
+            if not text:
+                failed.append(name)
+                text = f"Erreur de génération pour {name}. Veuillez réessayer."
+            sections[section_id] = split_paragraphs(text)
+    
+    return sections, failed
+
+
+async def generate_report_content(user_data: Dict[str, Any],
+                                  strict: bool = False) -> Tuple[Dict[str, Any], Dict[str, List[Tuple[str, str]]]]:
+    """
+    Analyse du projet et génération des sections, en recouvrement.
+    
+    Args:
+        strict: échec si une section ou l'analyse n'a pas pu être générée,
+            plutôt qu'un rapport avec messages d'erreur (rapports enregistrés)
+    
+    Returns:
+        (metadata, sections)
+    
+    Raises:
+        GenerationError: en mode strict, rapport incomplet
+    """
+    analysis = asyncio.ensure_future(analyze_project(user_data))
+    try:
+        sections, failed = await generate_all_sections(user_data, analysis)
+    finally:
+        analysis.cancel()  # sans effet si l'analyse est terminée
+    metadata = analysis.result()
+    
+    if strict:
+        if metadata.get('default_structure'):
+            failed.insert(0, "Analyse Structure")
+        if failed:
+            raise GenerationError(f"Génération incomplète ({', '.join(failed)}), veuillez réessayer")
+    return metadata, sections
+
+
+# ==================== STYLES PDF ====================
+
+# Couleurs et styles créés une seule fois et partagés par tous les PDF
+_NAVY = colors.HexColor('#002147')
+_DARKRED = colors.HexColor('#8B0000')
+_DARKGREY = colors.HexColor('#333333')
+_BLUE = colors.HexColor('#1a5490')
+
+# Styles page de garde
+ST_ROYAUME = ParagraphStyle(
+    'Royaume',
+    fontSize=11,
+    fontName='Helvetica-Bold',
+    alignment=TA_CENTER,
+    textColor=_DARKRED,
+    spaceAfter=3
+)
+
+ST_UNIV = ParagraphStyle(
+    'Univ',
+    fontSize=11,
+    fontName='Helvetica-Bold',
+    alignment=TA_CENTER,
+    textColor=_NAVY,
+    spaceAfter=4
+)
+
+ST_META = ParagraphStyle(
+    'Meta',
+    fontSize=10,
+    fontName='Helvetica',
+    spaceAfter=4,
+    textColor=_DARKGREY
+)
+
+ST_DOC_TYPE = ParagraphStyle(
+    'DocType',
+    fontSize=12,
+    fontName='Helvetica-Bold',
+    alignment=TA_CENTER,
+    letterSpacing=1.5,
+    spaceAfter=20,
+    textColor=_NAVY
+)
+
+ST_TITLE = ParagraphStyle(
+    'Title',
+    fontSize=16,
+    fontName='Helvetica-Bold',
+    alignment=TA_CENTER,
+    leading=20,
+    spaceBefore=10,
+    spaceAfter=15,
+    textColor=_NAVY,
+    borderWidth=2,
+    borderColor=_NAVY,
+    borderPadding=12
+)
+
+ST_SUBTITLE = ParagraphStyle(
+    'SubTitle',
+    fontSize=11,
+    fontName='Times-Italic',
+    alignment=TA_CENTER,
+    spaceAfter=25,
+    textColor=colors.grey
+)
+
+ST_LABEL = ParagraphStyle(
+    'Label',
+    fontSize=11,
+    fontName='Helvetica-Bold',
+    textColor=colors.black
+)
+
+# Styles contenu
+ST_SECTION_TITLE = ParagraphStyle(
+    'SectionTitle',
+    fontSize=14,
+    fontName='Helvetica-Bold',
+    textColor=_NAVY,
+    spaceBefore=25,
+    spaceAfter=15,
+    alignment=TA_CENTER,
+    borderWidth=1,
+    borderColor=_NAVY,
+    borderPadding=8
+)
+
+ST_CHAP_NUM = ParagraphStyle(
+    'ChapterNum',
+    fontSize=13,
+    fontName='Helvetica-Bold',
+    textColor=colors.grey,
+    spaceBefore=25,
+    spaceAfter=8
+)
+
+ST_CHAP_TITLE = ParagraphStyle(
+    'ChapterTitle',
+    fontSize=16,
+    fontName='Helvetica-Bold',
+    textColor=_NAVY,
+    spaceAfter=20,
+    leading=20
+)
+
+ST_BODY = ParagraphStyle(
+    'Body',
+    fontSize=11,
+    fontName='Times-Roman',
+    leading=17,
+    alignment=TA_JUSTIFY,
+    firstLineIndent=18,
+    spaceAfter=11,
+    textColor=colors.black
+)
+
+ST_SUBSECTION = ParagraphStyle(
+    'SubSection',
+    fontSize=12,
+    fontName='Helvetica-Bold',
+    textColor=_BLUE,
+    spaceBefore=15,
+    spaceAfter=10
+)
+
+ST_TOC = ParagraphStyle(
+    'TOC',
+    fontSize=11,
+    fontName='Helvetica',
+    leading=16,
+    spaceAfter=6
+)
+
+ST_YEAR = ParagraphStyle('Year', parent=ST_META, alignment=TA_CENTER, fontSize=11)
+
+# Styles de tableaux (partagés, ReportLab ne les modifie pas)
+_SEP_STYLES = {
+    weight: TableStyle([('LINEBELOW', (0,0), (-1,-1), weight, _NAVY)])
+    for weight in (1.5, 2)
+}
+
+_INTERV_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0,0), (-1,-1), 'TOP'),
+    ('BOTTOMPADDING', (0,0), (-1,-1), 8),
+])
+
+
+def separator_line(weight: float = 1.5) -> Table:
+    """Ligne décorative horizontale (épaisseur 1.5 ou 2)"""
+    line = Table([['']], colWidths=[15*cm])
+    line.setStyle(_SEP_STYLES[weight])
+    return line
 
 
 # ==================== PDF ENGINE PROFESSIONNEL ====================
@@ -548,27 +1358,20 @@ class PDFCanvas(canvas.Canvas):
     def __init__(self, *args, **kwargs):
         self.student_name = kwargs.pop('student_name', 'Étudiant')
         canvas.Canvas.__init__(self, *args, **kwargs)
-        self._saved_page_states = []
 
     def showPage(self):
-        self._saved_page_states.append(dict(self.__dict__))
-        self._startPage()
-
-    def save(self):
-        num_pages = len(self._saved_page_states)
-        for state in self._saved_page_states:
-            self.__dict__.update(state)
-            self.draw_footer(num_pages)
-            canvas.Canvas.showPage(self)
-        canvas.Canvas.save(self)
-
-    def draw_footer(self, total_pages):
+        # Le pied de page ne dépend que du numéro courant : il est dessiné
+        # directement, sans mémoriser l'état de chaque page jusqu'à save()
+        self.draw_footer()
+        canvas.Canvas.showPage(self)
+
+    def draw_footer(self):
         """Pied de page professionnel"""
         page = self._pageNumber
         if page > 1:  # Pas de footer sur page de garde
             self.saveState()
             # Ligne de séparation
-            self.setStrokeColor(colors.HexColor('#002147'))
+            self.setStrokeColor(_NAVY)
             self.setLineWidth(0.5)
             self.line(72, 50, A4[0]-72, 50)
             # Texte footer
@@ -579,21 +1382,47 @@ class PDFCanvas(canvas.Canvas):
             self.restoreState()
 
 
-def create_professional_pdf(user_data: Dict[str, Any], sections: Dict[str, str], 
-                           metadata: Dict[str, Any]) -> str:
+def append_paragraphs(story: List, paragraphs: List[Tuple[str, str]]):
+    """Ajoute au story les paragraphes pré-découpés d'une section"""
+    for kind, para in paragraphs:
+        story.append(Paragraph(para, ST_SUBSECTION if kind == 'sub' else ST_BODY))
+
+
+# Champs du formulaire dont dépend le contenu du rapport
+REPORT_FIELDS = ('subject', 'student_name', 'supervisor', 'student_filiere', 'context',
+                 'technologies', 'objectives', 'domain', 'methodology', 'results',
+                 'company', 'jury', 'academic_year')
+
+
+def report_id(user_data: Dict[str, Any]) -> str:
     """
-    Génère un PDF académique professionnel complet.
+    Identifiant déterministe du rapport, dérivé du formulaire : une même
+    demande correspond toujours au même fichier dans OUTPUT_FOLDER.
     
-    Returns:
-        Nom du fichier PDF
+    Seuls les champs de REPORT_FIELDS comptent, convertis en texte comme dans
+    les prompts : un champ inconnu ou non sérialisable (entier de plus de
+    64 bits...) ne fait pas échouer la requête.
+    """
+    fields = {field: str(user_data[field]) for field in REPORT_FIELDS if field in user_data}
+    raw = orjson.dumps(fields, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def report_filename(rid: str) -> str:
+    """Nom de fichier du rapport d'identifiant rid"""
+    return f"Rapport_PFE_{rid}.pdf"
+
+
+def create_professional_pdf(user_data: Dict[str, Any], sections: Dict[str, List[Tuple[str, str]]],
+                           metadata: Dict[str, Any], out: BinaryIO) -> None:
     """
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"Rapport_PFE_{timestamp}.pdf"
-    filepath = os.path.join(OUTPUT_FOLDER, filename)
+    Génère un PDF académique professionnel complet.
     
+    Le PDF est écrit directement dans `out` (BytesIO, fichier ouvert en 'wb'...).
+    """
     # Document
     doc = SimpleDocTemplate(
-        filepath,
+        out,
         pagesize=A4,
         rightMargin=2.5*cm,
         leftMargin=2.5*cm,
@@ -601,137 +1430,6 @@ def create_professional_pdf(user_data: Dict[str, Any], sections: Dict[str, str],
         bottomMargin=3.5*cm
     )
     
-    # ==================== STYLES ====================
-    
-    styles = getSampleStyleSheet()
-    
-    # Styles page de garde
-    st_royaume = ParagraphStyle(
-        'Royaume',
-        fontSize=11,
-        fontName='Helvetica-Bold',
-        alignment=TA_CENTER,
-        textColor=colors.HexColor('#8B0000'),
-        spaceAfter=3
-    )
-    
-    st_univ = ParagraphStyle(
-        'Univ',
-        fontSize=11,
-        fontName='Helvetica-Bold',
-        alignment=TA_CENTER,
-        textColor=colors.HexColor('#002147'),
-        spaceAfter=4
-    )
-    
-    st_meta = ParagraphStyle(
-        'Meta',
-        fontSize=10,
-        fontName='Helvetica',
-        spaceAfter=4,
-        textColor=colors.HexColor('#333333')
-    )
-    
-    st_doc_type = ParagraphStyle(
-        'DocType',
-        fontSize=12,
-        fontName='Helvetica-Bold',
-        alignment=TA_CENTER,
-        letterSpacing=1.5,
-        spaceAfter=20,
-        textColor=colors.HexColor('#002147')
-    )
-    
-    st_title = ParagraphStyle(
-        'Title',
-        fontSize=16,
-        fontName='Helvetica-Bold',
-        alignment=TA_CENTER,
-        leading=20,
-        spaceBefore=10,
-        spaceAfter=15,
-        textColor=colors.HexColor('#002147'),
-        borderWidth=2,
-        borderColor=colors.HexColor('#002147'),
-        borderPadding=12
-    )
-    
-    st_subtitle = ParagraphStyle(
-        'SubTitle',
-        fontSize=11,
-        fontName='Times-Italic',
-        alignment=TA_CENTER,
-        spaceAfter=25,
-        textColor=colors.grey
-    )
-    
-    st_label = ParagraphStyle(
-        'Label',
-        fontSize=11,
-        fontName='Helvetica-Bold',
-        textColor=colors.black
-    )
-    
-    # Styles contenu
-    st_section_title = ParagraphStyle(
-        'SectionTitle',
-        fontSize=14,
-        fontName='Helvetica-Bold',
-        textColor=colors.HexColor('#002147'),
-        spaceBefore=25,
-        spaceAfter=15,
-        alignment=TA_CENTER,
-        borderWidth=1,
-        borderColor=colors.HexColor('#002147'),
-        borderPadding=8
-    )
-    
-    st_chap_num = ParagraphStyle(
-        'ChapterNum',
-        fontSize=13,
-        fontName='Helvetica-Bold',
-        textColor=colors.grey,
-        spaceBefore=25,
-        spaceAfter=8
-    )
-    
-    st_chap_title = ParagraphStyle(
-        'ChapterTitle',
-        fontSize=16,
-        fontName='Helvetica-Bold',
-        textColor=colors.HexColor('#002147'),
-        spaceAfter=20,
-        leading=20
-    )
-    
-    st_body = ParagraphStyle(
-        'Body',
-        fontSize=11,
-        fontName='Times-Roman',
-        leading=17,
-        alignment=TA_JUSTIFY,
-        firstLineIndent=18,
-        spaceAfter=11,
-        textColor=colors.black
-    )
-    
-    st_subsection = ParagraphStyle(
-        'SubSection',
-        fontSize=12,
-        fontName='Helvetica-Bold',
-        textColor=colors.HexColor('#1a5490'),
-        spaceBefore=15,
-        spaceAfter=10
-    )
-    
-    st_toc = ParagraphStyle(
-        'TOC',
-        fontSize=11,
-        fontName='Helvetica',
-        leading=16,
-        spaceAfter=6
-    )
-    
     # ==================== CONTENU PDF ====================
     
     story = []
@@ -740,71 +1438,64 @@ def create_professional_pdf(user_data: Dict[str, Any], sections: Dict[str, str],
     # ========== PAGE DE GARDE ==========
     
     story.append(Spacer(1, 0.4*cm))
-    story.append(Paragraph("ROYAUME DU MAROC", st_royaume))
-    story.append(Paragraph("Université Mohammed Premier", st_univ))
-    story.append(Paragraph("École Nationale des Sciences Appliquées - Oujda", st_univ))
+    story.append(Paragraph("ROYAUME DU MAROC", ST_ROYAUME))
+    story.append(Paragraph("Université Mohammed Premier", ST_UNIV))
+    story.append(Paragraph("École Nationale des Sciences Appliquées - Oujda", ST_UNIV))
     
     story.append(Spacer(1, 0.4*cm))
     
     # Ligne décorative
-    line = Table([['']], colWidths=[15*cm])
-    line.setStyle(TableStyle([
-        ('LINEBELOW', (0,0), (-1,-1), 2, colors.HexColor('#002147'))
-    ]))
-    story.append(line)
+    story.append(separator_line(2))
     
     story.append(Spacer(1, 0.5*cm))
     
     # Métadonnées
     story.append(Paragraph(
         f"<b>Département :</b> {metadata.get('department', 'N/A')}",
-        st_meta
+        ST_META
     ))
     story.append(Paragraph(
         f"<b>Filière :</b> {metadata.get('filiere', user_data.get('student_filiere', 'N/A'))}",
-        st_meta
+        ST_META
     ))
     story.append(Paragraph(
         f"<b>N° d'ordre :</b> {metadata.get('order_id', 'N/A')}",
-        st_meta
+        ST_META
     ))
     
     story.append(Spacer(1, 1.2*cm))
     
-    story.append(Paragraph("MÉMOIRE DE PROJET DE FIN D'ÉTUDE", st_doc_type))
+    story.append(Paragraph("MÉMOIRE DE PROJET DE FIN D'ÉTUDE", ST_DOC_TYPE))
     story.append(Spacer(1, 0.3*cm))
-    story.append(Paragraph(user_data['subject'].upper(), st_title))
+    story.append(Paragraph(user_data['subject'].upper(), ST_TITLE))
     story.append(Spacer(1, 0.2*cm))
     story.append(Paragraph(
         "Soutenu en vue de l'obtention du<br/>Diplôme d'Ingénieur d'État",
-        st_subtitle
+        ST_SUBTITLE
     ))
     
     story.append(Spacer(1, 1*cm))
     
     # Table intervenants
     interv_data = [
-        [Paragraph("<b>Réalisé par :</b>", st_label),
-         Paragraph(user_data.get('student_name', 'Étudiant'), st_body)]
+        [Paragraph("<b>Réalisé par :</b>", ST_LABEL),
+         Paragraph(user_data.get('student_name', 'Étudiant'), ST_BODY)]
     ]
     
     if user_data.get('supervisor'):
         interv_data.append([
-            Paragraph("<b>Encadrant(s) :</b>", st_label),
-            Paragraph(user_data['supervisor'], st_body)
+            Paragraph("<b>Encadrant(s) :</b>", ST_LABEL),
+            Paragraph(user_data['supervisor'], ST_BODY)
         ])
     
     if user_data.get('jury'):
         interv_data.append([
-            Paragraph("<b>Membres du Jury :</b>", st_label),
-            Paragraph(user_data['jury'], st_body)
+            Paragraph("<b>Membres du Jury :</b>", ST_LABEL),
+            Paragraph(user_data['jury'], ST_BODY)
         ])
     
     t_interv = Table(interv_data, colWidths=[5*cm, 10*cm])
-    t_interv.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 8),
-    ]))
+    t_interv.setStyle(_INTERV_TABLE_STYLE)
     story.append(t_interv)
     
     story.append(Spacer(1, 1.3*cm))
@@ -813,25 +1504,23 @@ def create_professional_pdf(user_data: Dict[str, Any], sections: Dict[str, str],
     year = user_data.get('academic_year', f'{datetime.now().year-1}/{datetime.now().year}')
     story.append(Paragraph(
         f"<b>Année Universitaire : {year}</b>",
-        ParagraphStyle('Year', parent=st_meta, alignment=TA_CENTER, fontSize=11)
+        ST_YEAR
     ))
     
     story.append(PageBreak())
     
     # ========== REMERCIEMENTS ==========
     
-    story.append(Paragraph("REMERCIEMENTS", st_section_title))
+    story.append(Paragraph("REMERCIEMENTS", ST_SECTION_TITLE))
     story.append(Spacer(1, 0.4*cm))
     
-    for para in sections.get('remerciements', '').split('\n\n'):
-        if para.strip():
-            story.append(Paragraph(para.strip(), st_body))
+    append_paragraphs(story, sections.get('remerciements', []))
     
     story.append(PageBreak())
     
     # ========== TABLE DES MATIÈRES ==========
     
-    story.append(Paragraph("TABLE DES MATIÈRES", st_section_title))
+    story.append(Paragraph("TABLE DES MATIÈRES", ST_SECTION_TITLE))
     story.append(Spacer(1, 0.6*cm))
     
     toc_items = ["I. Introduction Générale"]
@@ -840,75 +1529,47 @@ def create_professional_pdf(user_data: Dict[str, Any], sections: Dict[str, str],
     toc_items.extend(["Conclusion Générale", "Bibliographie & Webographie"])
     
     for item in toc_items:
-        story.append(Paragraph(f"<b>{item}</b>", st_toc))
+        story.append(Paragraph(f"<b>{item}</b>", ST_TOC))
     
     story.append(PageBreak())
     
     # ========== INTRODUCTION ==========
     
-    story.append(Paragraph("INTRODUCTION GÉNÉRALE", st_section_title))
+    story.append(Paragraph("INTRODUCTION GÉNÉRALE", ST_SECTION_TITLE))
     story.append(Spacer(1, 0.4*cm))
     
-    for para in sections.get('introduction', '').split('\n\n'):
-        para = para.strip()
-        if not para:
-            continue
-        if para.startswith('##'):
-            story.append(Paragraph(para.replace('##', '').strip(), st_subsection))
-        else:
-            story.append(Paragraph(para, st_body))
+    append_paragraphs(story, sections.get('introduction', []))
     
     story.append(PageBreak())
     
     # ========== CHAPITRES ==========
     
     for i, chap in enumerate(structure, 1):
-        story.append(Paragraph(f"CHAPITRE {i}", st_chap_num))
-        story.append(Paragraph(chap['title'].upper(), st_chap_title))
+        story.append(Paragraph(f"CHAPITRE {i}", ST_CHAP_NUM))
+        story.append(Paragraph(chap['title'].upper(), ST_CHAP_TITLE))
         
-        chap_line = Table([['']], colWidths=[15*cm])
-        chap_line.setStyle(TableStyle([
-            ('LINEBELOW', (0,0), (-1,-1), 1.5, colors.HexColor('#002147'))
-        ]))
-        story.append(chap_line)
+        story.append(separator_line())
         story.append(Spacer(1, 0.4*cm))
         
-        content = sections.get(chap['id'], 'Contenu non disponible.')
-        for para in content.split('\n\n'):
-            para = para.strip()
-            if not para:
-                continue
-            if para.startswith('##'):
-                story.append(Paragraph(para.replace('##', '').strip(), st_subsection))
-            else:
-                story.append(Paragraph(para, st_body))
+        append_paragraphs(story, sections.get(chap['id'], [('body', 'Contenu non disponible.')]))
         
         story.append(PageBreak())
     
     # ========== CONCLUSION ==========
     
-    story.append(Paragraph("CONCLUSION GÉNÉRALE", st_section_title))
+    story.append(Paragraph("CONCLUSION GÉNÉRALE", ST_SECTION_TITLE))
     story.append(Spacer(1, 0.4*cm))
     
-    for para in sections.get('conclusion', '').split('\n\n'):
-        para = para.strip()
-        if not para:
-            continue
-        if para.startswith('##'):
-            story.append(Paragraph(para.replace('##', '').strip(), st_subsection))
-        else:
-            story.append(Paragraph(para, st_body))
+    append_paragraphs(story, sections.get('conclusion', []))
     
     story.append(PageBreak())
     
     # ========== BIBLIOGRAPHIE ==========
     
-    story.append(Paragraph("BIBLIOGRAPHIE & WEBOGRAPHIE", st_section_title))
+    story.append(Paragraph("BIBLIOGRAPHIE & WEBOGRAPHIE", ST_SECTION_TITLE))
     story.append(Spacer(1, 0.4*cm))
     
-    for para in sections.get('biblio', '').split('\n\n'):
-        if para.strip():
-            story.append(Paragraph(para.strip(), st_body))
+    append_paragraphs(story, sections.get('biblio', []))
     
     # ========== BUILD ==========
     
@@ -921,12 +1582,222 @@ def create_professional_pdf(user_data: Dict[str, Any], sections: Dict[str, str],
         )
     )
     
-    logger.info(f"✅ PDF créé: {filename}")
-    return filename
+    logger.info("✅ PDF créé")
+
+
+def render_pdf(user_data: Dict[str, Any], sections: Dict[str, List[Tuple[str, str]]],
+               metadata: Dict[str, Any]) -> bytes:
+    """Génère le PDF en mémoire et retourne son contenu (exécuté dans get_pdf_pool())"""
+    buffer = io.BytesIO()
+    create_professional_pdf(user_data, sections, metadata, buffer)
+    return buffer.getvalue()
+
+
+def save_pdf(user_data: Dict[str, Any], sections: Dict[str, List[Tuple[str, str]]],
+             metadata: Dict[str, Any], filename: str) -> str:
+    """
+    Génère le PDF directement dans OUTPUT_FOLDER et retourne son URL publique.
+    
+    L'écriture passe par un fichier temporaire renommé à la fin, pour ne
+    jamais exposer un PDF partiel via /download.
+    """
+    path = os.path.join(OUTPUT_FOLDER, filename)
+    tmp = f"{path}.{secrets.token_hex(4)}.tmp"  # requêtes identiques simultanées
+    try:
+        with open(tmp, 'wb') as f:
+            create_professional_pdf(user_data, sections, metadata, f)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return f'/static/rapports/{filename}'
+
+
+# ==================== PRÉCHAUFFAGE ====================
+
+# Rapport minimal rendu au démarrage par chaque worker PDF
+_WARMUP_USER_DATA = {'subject': 'Préchauffage', 'student_name': 'Étudiant', 'supervisor': 'Encadrant'}
+_WARMUP_SECTIONS = {'introduction': [('sub', 'Préchauffage'), ('body', 'Texte de préchauffage.')]}
+
+
+async def ping_groq() -> bool:
+    """Requête minimale : résolution DNS, TLS et connexion keep-alive prêtes"""
+    client = get_groq_client()
+    if not client:
+        return False
+    async with _GROQ_SEM:
+        await _groq_limiter.acquire()
+        await client.chat.completions.create(
+            messages=[{"role": "user", "content": "ping"}],
+            model=DEFAULT_MODEL,
+            max_tokens=1
+        )
+    return True
+
+
+def warmup():
+    """
+    Prépare le processus avant la première requête : connexion Groq ouverte
+    et workers PDF démarrés (imports et premier rendu ReportLab faits).
+    
+    À appeler au lancement du serveur, jamais à l'import du module (les
+    workers PDF le réimportent).
+    """
+    try:
+        if run_async(ping_groq()):
+            logger.info("🔥 Connexion Groq préchauffée")
+    except Exception as e:
+        logger.warning(f"⚠️ Préchauffage Groq: {e}")
+    
+    try:
+        futures = [
+            get_pdf_pool().submit(render_pdf, _WARMUP_USER_DATA, _WARMUP_SECTIONS, {})
+            for _ in range(PDF_WORKERS)
+        ]
+        for future in futures:
+            future.result()
+        logger.info(f"🔥 {PDF_WORKERS} worker(s) PDF prêts")
+    except Exception as e:
+        logger.warning(f"⚠️ Préchauffage PDF: {e}")
+
+
+# ==================== TÂCHES DE FOND ====================
+
+# État des générations lancées par /generate?save=1, partagé entre workers via
+# le disque : <id>.pending pendant la génération, <id>.error en cas d'échec
+JOBS_DIR = Path(os.getenv('JOBS_DIR', '.jobs')).resolve()
+JOBS_DIR.mkdir(exist_ok=True)
+# Le marqueur .pending est rafraîchi toutes les JOB_HEARTBEAT secondes tant que
+# la génération tourne ; sans rafraîchissement depuis JOB_TTL, elle est perdue
+JOB_HEARTBEAT = 30
+JOB_TTL = 3 * JOB_HEARTBEAT
+
+# Générations lancées par ce processus (références conservées jusqu'à la fin)
+JOBS: Dict[str, Future] = {}
+
+_RE_JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+
+async def heartbeat_marker(path: Path) -> None:
+    """Rafraîchit la date du marqueur jusqu'à annulation"""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+
+async def run_report_job(user_data: Dict[str, Any], filename: str, pending: Path) -> str:
+    """
+    Génération complète d'un rapport enregistré : contenu puis PDF.
+    
+    Un rapport incomplet n'est pas enregistré (GenerationError) : il serait
+    sinon renvoyé tel quel à chaque demande identique. Le marqueur `pending`
+    est maintenu frais pendant toute la génération.
+    """
+    heartbeat = asyncio.ensure_future(heartbeat_marker(pending))
+    try:
+        metadata, sections = await generate_report_content(user_data, strict=True)
+        logger.info("📄 Création du PDF...")
+        pdf_url = await asyncio.get_running_loop().run_in_executor(
+            get_pdf_pool(), save_pdf, user_data, sections, metadata, filename
+        )
+    finally:
+        heartbeat.cancel()
+    logger.info(f"💾 PDF enregistré: {filename}")
+    return pdf_url
+
+
+def job_age(path: Path) -> float:
+    """Âge d'un marqueur en secondes (infini s'il n'existe pas)"""
+    try:
+        return time.time() - path.stat().st_mtime
+    except FileNotFoundError:
+        return float('inf')
+
+
+def create_marker(path: Path) -> bool:
+    """Création exclusive d'un marqueur (False s'il existe déjà)"""
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+
+def acquire_job_marker(pending: Path) -> bool:
+    """
+    Prend le marqueur d'une génération, en reprenant un marqueur orphelin
+    (worker arrêté pendant la génération, non rafraîchi depuis JOB_TTL).
+    
+    La reprise passe par un renommage atomique : un seul worker l'obtient.
+    """
+    if create_marker(pending):
+        return True
+    if job_age(pending) < JOB_TTL:
+        return False
+    
+    orphan = pending.with_name(f"{pending.name}.{secrets.token_hex(4)}")
+    try:
+        os.rename(pending, orphan)
+    except FileNotFoundError:
+        return False  # repris ou terminé entre-temps
+    if job_age(orphan) < JOB_TTL:
+        # Marqueur déjà repris par un autre worker juste avant : restitué
+        os.rename(orphan, pending)
+        return False
+    orphan.unlink()
+    return create_marker(pending)
+
+
+def start_report_job(job_id: str, user_data: Dict[str, Any]) -> None:
+    """
+    Lance la génération en arrière-plan sur la boucle partagée, sauf si la
+    même demande est déjà en cours (dans ce processus ou un autre worker).
+    """
+    pending = JOBS_DIR / f"{job_id}.pending"
+    if not acquire_job_marker(pending):
+        return
+    # Génération terminée entre la vérification de /generate et la prise du marqueur
+    if (OUTPUT_DIR / report_filename(job_id)).is_file():
+        pending.unlink(missing_ok=True)
+        return
+    (JOBS_DIR / f"{job_id}.error").unlink(missing_ok=True)
+    
+    future = asyncio.run_coroutine_threadsafe(
+        run_report_job(user_data, report_filename(job_id), pending), get_event_loop()
+    )
+    JOBS[job_id] = future
+    future.add_done_callback(lambda f: finish_report_job(job_id, f))
+
+
+def finish_report_job(job_id: str, future: Future) -> None:
+    """Enregistre l'issue d'une génération et libère son marqueur"""
+    JOBS.pop(job_id, None)
+    error = future.exception() if not future.cancelled() else 'Génération annulée'
+    if error is not None:
+        logger.error(f"❌ Génération {job_id}: {error}")
+        (JOBS_DIR / f"{job_id}.error").write_text(str(error), encoding='utf-8')
+    (JOBS_DIR / f"{job_id}.pending").unlink(missing_ok=True)
 
 
 # ==================== ROUTES ====================
 
+def ojson(obj: Any, status: int = 200) -> Response:
+    """Réponse JSON sérialisée par orjson (obj peut être déjà sérialisé en bytes)"""
+    body = obj if isinstance(obj, bytes) else orjson.dumps(obj)
+    return Response(body, status=status, mimetype='application/json')
+
+
+REQUIRED_FIELDS = ('subject', 'student_name', 'supervisor')
+
+# Corps JSON des erreurs de validation, sérialisés une seule fois
+_REQUIRED_ERRORS = {
+    field: orjson.dumps({'success': False, 'error': f'Champ requis: {field}'})
+    for field in REQUIRED_FIELDS
+}
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -934,51 +1805,113 @@ def index():
 
 @app.route('/generate', methods=['POST'])
 def generate():
-    """Endpoint principal de génération"""
+    """
+    Endpoint principal de génération.
+    
+    Renvoie directement le PDF, sans écriture disque. Avec ?save=1, la
+    génération se poursuit en arrière-plan : réponse 202 immédiate avec
+    l'identifiant à suivre sur /status/<job_id>, le PDF étant enregistré
+    dans OUTPUT_FOLDER. Une demande identique à un rapport déjà enregistré
+    le renvoie sans nouvelle génération.
+    """
     try:
         data = request.json
         logger.info(f"🚀 Nouvelle génération: {data.get('subject', 'Sans titre')}")
         
         # Validation
-        required = ['subject', 'student_name', 'supervisor']
-        for field in required:
+        for field in REQUIRED_FIELDS:
             if not data.get(field):
-                return jsonify({'success': False, 'error': f'Champ requis: {field}'}), 400
+                return ojson(_REQUIRED_ERRORS[field], 400)
+        
+        # Demande déjà traitée : le PDF enregistré est renvoyé tel quel
+        job_id = report_id(data)
+        pdf_filename = report_filename(job_id)
+        pdf_path = OUTPUT_DIR / pdf_filename
+        if pdf_path.is_file():
+            logger.info(f"⚡ Rapport déjà généré: {pdf_filename}")
+            if request.args.get('save') != '1':
+                return send_file(pdf_path, mimetype='application/pdf',
+                                 as_attachment=True, download_name=pdf_filename)
+            return ojson({
+                'success': True,
+                'pdf_url': f'/static/rapports/{pdf_filename}',
+                'filename': pdf_filename,
+                'cached': True
+            })
         
-        # ÉTAPE 1: Analyse
-        logger.info("📊 Analyse du projet...")
-        metadata = analyze_project(data)
+        # PDF enregistré : génération en arrière-plan, suivie via /status
+        if request.args.get('save') == '1':
+            start_report_job(job_id, data)
+            logger.info(f"⏳ Génération en arrière-plan: {job_id}")
+            return ojson({
+                'success': True,
+                'job_id': job_id,
+                'status_url': f'/status/{job_id}'
+            }, 202)
         
-        # ÉTAPE 2: Génération sections
-        logger.info("✍️ Génération du contenu...")
-        sections = generate_all_sections(data, metadata)
+        # ÉTAPES 1-2: Analyse et génération des sections (en recouvrement)
+        logger.info("📊 Analyse du projet et génération du contenu...")
+        metadata, sections = run_async(generate_report_content(data))
         
         # ÉTAPE 3: PDF
         logger.info("📄 Création du PDF...")
-        pdf_filename = create_professional_pdf(data, sections, metadata)
-        
-        return jsonify({
+        pdf_bytes = get_pdf_pool().submit(
+            render_pdf, data, sections, metadata
+        ).result()
+        return send_file(io.BytesIO(pdf_bytes), mimetype='application/pdf',
+                         as_attachment=True, download_name=pdf_filename)
+    
+    except Exception as e:
+        logger.error(f"❌ Erreur: {e}", exc_info=True)
+        return ojson({'success': False, 'error': str(e)}, 500)
+
+
+@app.route('/status/<job_id>')
+def status(job_id):
+    """État d'une génération lancée par /generate?save=1"""
+    if not _RE_JOB_ID.fullmatch(job_id):
+        return ojson({'success': False, 'state': 'unknown', 'error': 'Génération introuvable'}, 404)
+    
+    pdf_filename = report_filename(job_id)
+    if (OUTPUT_DIR / pdf_filename).is_file():
+        return ojson({
             'success': True,
+            'state': 'done',
             'pdf_url': f'/static/rapports/{pdf_filename}',
-            'filename': pdf_filename,
-            'metadata': metadata
+            'filename': pdf_filename
         })
     
-    except Exception as e:
-        logger.error(f"❌ Erreur: {e}", exc_info=True)
-        return jsonify({'success': False, 'error': str(e)}), 500
+    age = job_age(JOBS_DIR / f"{job_id}.pending")
+    if age < JOB_TTL:
+        return ojson({'success': True, 'state': 'pending'})
+    if age != float('inf'):
+        return ojson({'success': False, 'state': 'error', 'error': 'Génération interrompue, veuillez réessayer'})
+    
+    error_file = JOBS_DIR / f"{job_id}.error"
+    if error_file.is_file():
+        return ojson({'success': False, 'state': 'error', 'error': error_file.read_text(encoding='utf-8')})
+    
+    return ojson({'success': False, 'state': 'unknown', 'error': 'Génération introuvable'}, 404)
 
 
 @app.route('/download/<filename>')
 def download(filename):
     """Téléchargement PDF"""
     try:
-        filepath = os.path.join(OUTPUT_FOLDER, filename)
-        if not os.path.exists(filepath):
-            return jsonify({'error': 'Fichier introuvable'}), 404
+        # resolve() suit '..' et les liens symboliques ; is_relative_to
+        # refuse alors tout chemin sorti de OUTPUT_DIR
+        filepath = (OUTPUT_DIR / filename).resolve()
+        if not filepath.is_relative_to(OUTPUT_DIR) or not filepath.is_file():
+            return ojson({'error': 'Fichier introuvable'}, 404)
+        if USE_XACCEL:
+            # nginx lit et envoie le fichier : le worker est libéré immédiatement
+            response = Response(mimetype='application/pdf')
+            response.headers['X-Accel-Redirect'] = f'{XACCEL_PREFIX}{filename}'
+            response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
         return send_file(filepath, mimetype='application/pdf', as_attachment=True, download_name=filename)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return ojson({'error': str(e)}, 500)
 
 
 # ==================== MAIN ====================
@@ -998,4 +1931,8 @@ if __name__ == '__main__':
     logger.info(f"🌐 Serveur: http://127.0.0.1:5000")
     logger.info("=" * 70)
     
+    # Avec le reloader de debug, seul le processus enfant sert les requêtes
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warmup()
+    
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,38 @@
+"""
+gunicorn.conf.py - Configuration de production
+Lancement: gunicorn app:app
+"""
+
+import os
+
+# Application WSGI (Flask) : workers threadés, chaque requête attend Groq
+# sans bloquer les autres ; le travail CPU des PDF part dans get_pdf_pool()
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# Imports lourds (Flask, ReportLab, Groq) faits une fois dans le maître,
+# partagés par copy-on-write entre les workers
+preload_app = True
+
+# Une génération complète dure plusieurs dizaines de secondes
+timeout = 180
+graceful_timeout = 30
+keepalive = 30
+
+# Heartbeat des workers en mémoire plutôt que sur disque
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def post_fork(server, worker):
+    """Les threads du maître (écriture des logs) n'existent pas après le fork"""
+    from app import start_log_listener
+    start_log_listener()
+
+
+def post_worker_init(worker):
+    """Connexion Groq et workers PDF prêts avant la première requête"""
+    from app import warmup
+    warmup()
+
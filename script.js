@@ -43,7 +43,7 @@ document.addEventListener('DOMContentLoaded', function() {
         
         try {
             // Envoyer la requête
-            const response = await fetch('/generate', {
+            const response = await fetch('/generate?save=1', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -51,7 +51,12 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify(formData)
             });
             
-            const result = await response.json();
+            let result = await response.json();
+            
+            // Génération en arrière-plan : attendre la fin via /status
+            if (response.status === 202) {
+                result = await waitForReport(result.status_url);
+            }
             
             if (result.success) {
                 // Afficher l'aperçu
@@ -166,6 +171,22 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Suivi d'une génération en arrière-plan (2 s entre deux appels, 5 min max)
+    async function waitForReport(statusUrl, maxAttempts = 150) {
+        for (let attempt = 0; attempt < maxAttempts; attempt++) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            const response = await fetch(statusUrl);
+            if (!response.ok) {
+                return { success: false, error: `Erreur serveur (${response.status})` };
+            }
+            const status = await response.json();
+            if (status.state !== 'pending') {
+                return status;
+            }
+        }
+        return { success: false, error: 'La génération prend trop de temps, veuillez réessayer.' };
+    }
+
     // Animation de progression
     function animateProgress() {
         let width = 0;